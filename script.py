@@ -1,35 +1,102 @@
 import requests
-import json
+from requests.adapters import HTTPAdapter
+import hashlib
+import orjson
 import geopandas as gpd
 import matplotlib.pyplot as plt
-from shapely.geometry import LineString, Polygon, Point, box  # Fixed Missing Import
+from matplotlib.collections import Collection, LineCollection, PolyCollection
+from matplotlib.colors import to_rgba
+from matplotlib.patches import Patch
+from matplotlib.artist import Artist
+import numpy as np
+import shapely
+from shapely.geometry import Point, box  # Fixed Missing Import
 import pyproj
 from pathlib import Path
 import logging
 import time
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from operator import itemgetter
 from typing import Dict, List, Tuple, Optional
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
+@functools.cache
+def _get_transformer(src_crs: str, dst_crs: str) -> pyproj.Transformer:
+    """Return a shared Transformer for a CRS pair; PROJ initialisation is costly."""
+    return pyproj.Transformer.from_crs(src_crs, dst_crs, always_xy=True)
+
+
 class OSMMapGenerator:
     """Class to fetch and visualize OpenStreetMap data for a specified area, including water bodies."""
+
+    # Highway values drawn with a shared style; anything else uses the "default" road style
+    ROAD_STYLE_GROUPS = {
+        "motorway": "major",
+        "trunk": "major",
+        "primary": "major",
+        "secondary": "medium",
+        "tertiary": "medium",
+        "residential": "minor",
+        "service": "minor",
+    }
+
+    # Dense area layers drawn as raster images inside vector (PDF) output
+    RASTERIZED_FEATURES = {"forests", "buildings"}
+
+    # Resolution of the saved JPG and of rasterized layers in the PDF
+    OUTPUT_DPI = 300
+
+    # OSM tags kept as GeoDataFrame columns per feature type; everything else is dropped
+    FEATURE_TAGS = {
+        "roads": ("highway",),
+    }
     
-    def __init__(self, center_lat: float, center_lon: float, radius_meters: float = 500):
+    def __init__(self, center_lat: float, center_lon: float, radius_meters: float = 500,
+                 simplify_tolerance: Optional[float] = 1e-5, cache_ttl: Optional[float] = 24 * 3600,
+                 batch_queries: bool = True, keep_geodataframes: bool = False,
+                 render_backend: str = "matplotlib", coordinate_decimals: Optional[int] = 5,
+                 persist_layers: bool = True):
         self.center_lat = center_lat
         self.center_lon = center_lon
         self.radius_meters = radius_meters
+        # Simplification tolerance in degrees (1e-5 ≈ 1 m); None or 0 disables it
+        self.simplify_tolerance = simplify_tolerance
+        # Node coordinates are rounded to this many decimals (5 ≈ 1 m); None keeps full precision
+        self.coordinate_decimals = coordinate_decimals
+        # Seconds before a cached Overpass response is refetched; None never expires
+        self.cache_ttl = cache_ttl
+        # Store processed layers as output/<feature>.parquet (needs pyarrow) so reruns skip fetch and build
+        self.persist_layers = persist_layers
+        # Fetch all features with one union query, or one query per feature issued concurrently
+        self.batch_queries = batch_queries
+        # Plotting never needs GeoDataFrames; opt in to keep them in self.gdfs for export or spatial joins
+        self.keep_geodataframes = keep_geodataframes
+        self.gdfs: Dict[str, gpd.GeoDataFrame] = {}
+        # "datashader" rasterizes the dense RASTERIZED_FEATURES layers into a single image
+        if render_backend not in ("matplotlib", "datashader"):
+            raise ValueError(f"Unknown render backend: {render_backend}")
+        self.render_backend = render_backend
         self.overpass_url = "https://overpass-api.de/api/interpreter"
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
         self.output_dir = Path("output")
         self.output_dir.mkdir(exist_ok=True)
         
         # Coordinate transformations
-        self.wgs84_to_lks92 = pyproj.Transformer.from_crs("EPSG:4326", "EPSG:25884", always_xy=True)
-        self.lks92_to_wgs84 = pyproj.Transformer.from_crs("EPSG:25884", "EPSG:4326", always_xy=True)
+        self.wgs84_to_lks92 = _get_transformer("EPSG:4326", "EPSG:25884")
+        self.lks92_to_wgs84 = _get_transformer("EPSG:25884", "EPSG:4326")
         
         # Calculate bounding box
         self.bbox = self._calculate_bbox()
+        self.bbox_polygon = box(self.bbox[1], self.bbox[0], self.bbox[3], self.bbox[2])  # west, south, east, north
+        # Prepared geometries let GEOS answer repeated intersects() tests from a cached index;
+        # Shapely only uses it when the prepared geometry is the first predicate argument
+        shapely.prepare(self.bbox_polygon)
         
         # Define feature styles
         self.styles = {
@@ -40,14 +107,10 @@ class OSMMapGenerator:
             "lakes": {"color": "deepskyblue", "alpha": 0.7, "label": "Lakes"},
             "channels": {"color": "lightblue", "linewidth": 1.2, "label": "Channels"},
             "roads": {
-                "motorway": {"color": "orangered", "linewidth": 2.5},
-                "trunk": {"color": "orangered", "linewidth": 2.5},
-                "primary": {"color": "orangered", "linewidth": 2.5},
-                "secondary": {"color": "orange", "linewidth": 1.8},
-                "tertiary": {"color": "orange", "linewidth": 1.8},
-                "residential": {"color": "gray", "linewidth": 1.2},
-                "service": {"color": "gray", "linewidth": 1.2},
-                "default": {"color": "black", "linewidth": 0.8, "linestyle": "--"}
+                "major": {"color": "orangered", "linewidth": 2.5, "label": "Major roads"},
+                "medium": {"color": "orange", "linewidth": 1.8, "label": "Medium roads"},
+                "minor": {"color": "gray", "linewidth": 1.2, "label": "Minor roads"},
+                "default": {"color": "black", "linewidth": 0.8, "linestyle": "--", "label": "Other roads"}
             }
         }
     
@@ -57,9 +120,11 @@ class OSMMapGenerator:
         xmin, xmax = center_x - self.radius_meters, center_x + self.radius_meters
         ymin, ymax = center_y - self.radius_meters, center_y + self.radius_meters
         
-        bbox_wgs84 = [self.lks92_to_wgs84.transform(x, y) for x, y in [(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin)]]
-        south, west = bbox_wgs84[0][1], bbox_wgs84[0][0]
-        north, east = bbox_wgs84[2][1], bbox_wgs84[2][0]
+        xs = np.array([xmin, xmin, xmax, xmax])
+        ys = np.array([ymin, ymax, ymax, ymin])
+        lons, lats = self.lks92_to_wgs84.transform(xs, ys)
+        south, west = float(lats[0]), float(lons[0])
+        north, east = float(lats[2]), float(lons[2])
         
         return south, west, north, east
 
@@ -70,19 +135,36 @@ class OSMMapGenerator:
             logger.error(f"No query found for {feature_type}")
             return None
 
+        cache_file = self.output_dir / f"cache_{hashlib.sha1(query.encode()).hexdigest()}.json"
+        cached = self._load_cache(cache_file)
+        if cached is not None:
+            logger.info(f"📦 Loaded {len(cached.get('elements', []))} {feature_type} elements from cache.")
+            return cached
+
         logger.info(f"Fetching {feature_type} data from Overpass...")
 
         for attempt in range(3):
             try:
-                response = requests.get(self.overpass_url, params={"data": query}, timeout=30)
+                response = self.session.get(self.overpass_url, params={"data": query}, timeout=30)
                 response.raise_for_status()
-                data = response.json()
+                data = orjson.loads(response.content)
+
+                # Overpass reports timeouts and memory aborts as HTTP 200 with a truncated element list
+                if data.get("remark"):
+                    logger.warning(f"Attempt {attempt+1}/3 returned incomplete data: {data['remark']}")
+                    time.sleep(5)
+                    continue
 
                 num_elements = len(data.get("elements", []))
                 logger.info(f"✅ Retrieved {num_elements} {feature_type} elements.")
 
+                try:
+                    cache_file.write_bytes(orjson.dumps(data))
+                except OSError as e:
+                    logger.warning(f"⚠️ Could not write cache {cache_file.name}: {str(e)}")
+
                 return data
-            except (requests.exceptions.RequestException, json.JSONDecodeError) as e:
+            except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
                 logger.warning(f"Attempt {attempt+1}/3 failed: {str(e)}")
                 time.sleep(5)
 
@@ -90,6 +172,70 @@ class OSMMapGenerator:
         return None
 
 
+    def _load_cache(self, cache_file: Path) -> Optional[dict]:
+        """Return a cached Overpass response, or None if it is missing, stale or unreadable."""
+        if not self._is_fresh(cache_file):
+            return None
+
+        try:
+            data = orjson.loads(cache_file.read_bytes())
+        except (OSError, orjson.JSONDecodeError) as e:
+            logger.warning(f"⚠️ Ignoring unreadable cache {cache_file.name}: {str(e)}")
+            return None
+
+        if data.get("remark"):
+            logger.warning(f"⚠️ Ignoring incomplete cache {cache_file.name}: {data['remark']}")
+            return None
+
+        return data
+
+    def _is_fresh(self, cache_file: Path) -> bool:
+        """Check that a cache file exists and is younger than cache_ttl."""
+        if not cache_file.exists():
+            return False
+
+        age = time.time() - cache_file.stat().st_mtime
+        if self.cache_ttl is not None and age > self.cache_ttl:
+            logger.info(f"Cache {cache_file.name} is stale ({age:.0f}s old).")
+            return False
+
+        return True
+
+    def _layer_params(self) -> dict:
+        """Settings a persisted layer must have been built with to be reused."""
+        return {
+            "bbox": list(self.bbox),
+            "simplify_tolerance": self.simplify_tolerance,
+            "coordinate_decimals": self.coordinate_decimals,
+        }
+
+    def _load_layer(self, feature_type: str) -> Optional[gpd.GeoDataFrame]:
+        """Return a persisted GeoParquet layer, or None if it is missing, stale or built differently."""
+        layer_file = self.output_dir / f"{feature_type}.parquet"
+        if not self._is_fresh(layer_file):
+            return None
+
+        try:
+            gdf = gpd.read_parquet(layer_file)
+        except (ImportError, OSError, ValueError) as e:
+            logger.warning(f"⚠️ Ignoring unreadable layer {layer_file.name}: {str(e)}")
+            return None
+
+        if gdf.attrs.get("osm_params") != self._layer_params():
+            logger.info(f"Layer {layer_file.name} was built for a different area or settings.")
+            return None
+
+        return gdf
+
+    def _save_layer(self, gdf: gpd.GeoDataFrame, feature_type: str) -> None:
+        """Persist a processed layer as GeoParquet, tagged with the settings it was built with."""
+        # DataFrame.attrs round-trips through the Parquet schema metadata
+        gdf.attrs["osm_params"] = self._layer_params()
+        try:
+            gdf.to_parquet(self.output_dir / f"{feature_type}.parquet")
+        except (ImportError, OSError, ValueError) as e:
+            logger.warning(f"⚠️ Could not persist {feature_type} layer: {str(e)}")
+
     def _get_overpass_query(self, feature_type: str) -> str:
         """Generate Overpass API query for a specific feature type."""
         bbox_str = f"{self.bbox[0]},{self.bbox[1]},{self.bbox[2]},{self.bbox[3]}"
@@ -98,99 +244,346 @@ class OSMMapGenerator:
             "roads": f"""[out:json];(way["highway"]({bbox_str}););out geom;""",
             "buildings": f"""[out:json];(way["building"]({bbox_str}););out geom;""",
             "forests": f"""[out:json];(way["landuse"="forest"]({bbox_str});way["natural"="wood"]({bbox_str}););out geom;""",
-            "water": f"""[out:json];(way["natural"="water"]({bbox_str});way["waterway"]({bbox_str});relation["natural"="water"]({bbox_str});relation["waterway"]({bbox_str}););out geom;""",
+            "water": f"""[out:json];(wr["natural"="water"]({bbox_str});wr["waterway"]({bbox_str}););out geom;""",
             "rivers": f"""[out:json];(way["waterway"="river"]({bbox_str}););out geom;""",
-            "lakes": f"""[out:json];(way["natural"="water"]({bbox_str});relation["natural"="water"]({bbox_str}););out geom;""",
-            "channels": f"""[out:json];(way["waterway"="canal"]({bbox_str});way["waterway"="ditch"]({bbox_str});way["waterway"="stream"]({bbox_str}););out geom;"""
+            "lakes": f"""[out:json];(wr["natural"="water"]({bbox_str}););out geom;""",
+            "channels": f"""[out:json];(way["waterway"~"^(canal|ditch|stream)$"]({bbox_str}););out geom;"""
         }
 
+        if feature_type == "all":
+            return self._get_combined_query()
+
         return queries.get(feature_type, "")
 
+    def _get_combined_query(self) -> str:
+        """Generate a single Overpass union query covering every feature type."""
+        bbox_str = f"{self.bbox[0]},{self.bbox[1]},{self.bbox[2]},{self.bbox[3]}"
+
+        # "wr" matches ways and relations; nodes are never drawn, so "nwr" would only add payload
+        selectors = [
+            'way["highway"]',
+            'way["building"]',
+            'way["landuse"="forest"]',
+            'way["natural"~"^(wood|water)$"]',
+            'relation["natural"="water"]',
+            'wr["waterway"]',
+        ]
+        union = "".join(f"{selector}({bbox_str});" for selector in selectors)
+
+        return f"""[out:json];({union});out geom;"""
+
+    @staticmethod
+    def _classify_element(tags: dict) -> List[str]:
+        """Return the feature types an element belongs to, based on its OSM tags."""
+        natural = tags.get("natural")
+        waterway = tags.get("waterway")
+        matches = {
+            "roads": "highway" in tags,
+            "buildings": "building" in tags,
+            "forests": tags.get("landuse") == "forest" or natural == "wood",
+            "water": natural == "water" or waterway is not None,
+            "rivers": waterway == "river",
+            "lakes": natural == "water",
+            "channels": waterway in ("canal", "ditch", "stream"),
+        }
+        return [feature_type for feature_type, matched in matches.items() if matched]
+
+    def split_osm_data(self, data: Optional[dict], feature_types: List[str]) -> Dict[str, Optional[dict]]:
+        """Partition a combined Overpass response into per-feature responses."""
+        if not data or "elements" not in data:
+            return {ft: None for ft in feature_types}
+
+        split = {ft: {"elements": []} for ft in feature_types}
+        for element in data["elements"]:
+            for feature_type in self._classify_element(element.get("tags", {})):
+                if feature_type in split:
+                    split[feature_type]["elements"].append(element)
+
+        return split
+
 
     def process_osm_data(self, data: Optional[dict], feature_type: str) -> gpd.GeoDataFrame:
         """Process OSM data into a GeoDataFrame and clip to bounding box."""
+        geometries, properties = self._prepare_geometries(data, feature_type)
+        return gpd.GeoDataFrame(properties, geometry=geometries, crs="EPSG:4326")
+
+    def _prepare_geometries(self, data: Optional[dict], feature_type: str) -> Tuple[np.ndarray, List[dict]]:
+        """Build clipped and simplified geometries plus their kept tags for one feature type."""
         if not data or "elements" not in data:
             logger.warning(f"⚠️ No data found for {feature_type}")
-            return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+            return np.empty(0, dtype=object), []
 
-        geometries = []
-        properties = []
         geometry_type = "polygon" if feature_type in ["buildings", "forests", "lakes"] else "line"
 
-        for element in data.get("elements", []):
-            if element["type"] == "way" and "geometry" in element:
-                coords = [(node["lon"], node["lat"]) for node in element["geometry"]]
-                if len(coords) < 2:
-                    continue
-                geo = Polygon(coords) if geometry_type == "polygon" and len(coords) >= 3 else LineString(coords)
-                geometries.append(geo)
-                properties.append(element.get("tags", {}))
-
-        gdf = gpd.GeoDataFrame(properties, geometry=geometries, crs="EPSG:4326")
+        ways = [
+            element for element in data.get("elements", [])
+            if element["type"] == "way" and len(element.get("geometry", [])) >= 2
+        ]
+        geometries = self._build_geometries(ways, geometry_type, self.coordinate_decimals)
+        needed_tags = self.FEATURE_TAGS.get(feature_type, ())
+        properties = [{tag: tags.get(tag) for tag in needed_tags} for tags in (way.get("tags", {}) for way in ways)]
 
         # Clip to bounding box
-        bbox_polygon = box(self.bbox[1], self.bbox[0], self.bbox[3], self.bbox[2])  # west, south, east, north
-        gdf_clipped = gdf.clip(bbox_polygon)
+        clipped, keep = self._clip_to_bbox(geometries)
+        properties = [properties[i] for i in np.flatnonzero(keep)]
 
-        logger.info(f"✅ {feature_type.capitalize()} before clipping: {len(gdf)} elements.")
-        logger.info(f"🔪 {feature_type.capitalize()} after clipping: {len(gdf_clipped)} elements.")
+        # Drop near-collinear vertices that add rendering cost without visible detail
+        if self.simplify_tolerance:
+            clipped = shapely.simplify(clipped, tolerance=self.simplify_tolerance, preserve_topology=False)
 
-        if gdf_clipped.empty:
-            logger.warning(f"⚠️ {feature_type} is empty after clipping!")
+        logger.info(f"✅ {feature_type.capitalize()} before clipping: {len(geometries)} elements.")
+        logger.info(f"🔪 {feature_type.capitalize()} after clipping: {len(clipped)} elements.")
 
-        return gdf_clipped
+        if len(clipped) == 0:
+            logger.warning(f"⚠️ {feature_type} is empty after clipping!")
 
+        return clipped, properties
+
+
+    def _clip_to_bbox(self, geometries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Clip to the bounding box, running GEOS intersection only on features crossing its edge.
+
+        Returns the clipped geometries and a mask of the input rows that were kept.
+        """
+        south, west, north, east = self.bbox
+        bounds = shapely.bounds(geometries).reshape(-1, 4)
+        inside = (bounds[:, 0] >= west) & (bounds[:, 1] >= south) & (bounds[:, 2] <= east) & (bounds[:, 3] <= north)
+        straddle = ~inside & shapely.intersects(self.bbox_polygon, geometries)
+
+        clipped = geometries.copy()
+        clipped[straddle] = shapely.intersection(geometries[straddle], self.bbox_polygon)
+        keep = inside | (straddle & ~shapely.is_empty(clipped))
+
+        return clipped[keep], keep
+
+    @staticmethod
+    def _build_geometries(ways: List[dict], geometry_type: str, decimals: Optional[int] = None) -> np.ndarray:
+        """Build Shapely geometries for OSM ways in bulk from flat coordinate arrays.
+
+        Ways left with fewer than two distinct nodes after rounding are returned as None.
+        """
+        counts = np.fromiter((len(way["geometry"]) for way in ways), dtype=np.intp, count=len(ways))
+        total = int(counts.sum())
+
+        # chain/itemgetter keep the per-node iteration in C, and fromiter writes straight into
+        # the preallocated float64 buffer without an intermediate node list or column_stack copy
+        coords = np.empty((total, 2), dtype=np.float64)
+        for column, key in enumerate(("lon", "lat")):
+            nodes = chain.from_iterable(map(itemgetter("geometry"), ways))
+            coords[:, column] = np.fromiter(map(itemgetter(key), nodes), dtype=np.float64, count=total)
+
+        if decimals is not None:
+            # Rounding makes nearby consecutive nodes identical, so the pass below drops them too
+            coords = np.round(coords, decimals)
+
+        # Drop repeated consecutive nodes within each way
+        way_index = np.repeat(np.arange(len(ways)), counts)
+        keep = np.ones(len(coords), dtype=bool)
+        keep[1:] = np.any(coords[1:] != coords[:-1], axis=1) | (way_index[1:] != way_index[:-1])
+        coords = coords[keep]
+        counts = np.bincount(way_index[keep], minlength=len(ways))
+
+        # A ring needs three distinct nodes; linearrings() closes open rings itself
+        starts = np.cumsum(counts) - counts
+        closed = np.all(coords[starts] == coords[starts + counts - 1], axis=1)
+        if geometry_type == "polygon":
+            is_polygon = counts - closed >= 3
+        else:
+            is_polygon = np.zeros(len(ways), dtype=bool)
+        is_line = ~is_polygon & (counts >= 2)
+
+        geometries = np.full(len(ways), None, dtype=object)
+        if is_polygon.any():
+            indices = np.repeat(np.arange(is_polygon.sum()), counts[is_polygon])
+            rings = shapely.linearrings(coords[np.repeat(is_polygon, counts)], indices=indices)
+            geometries[is_polygon] = shapely.polygons(rings)
+        if is_line.any():
+            indices = np.repeat(np.arange(is_line.sum()), counts[is_line])
+            geometries[is_line] = shapely.linestrings(coords[np.repeat(is_line, counts)], indices=indices)
+
+        # Rounding can make rings self-touch or cross, and some OSM outlines are invalid to begin
+        # with; either makes the bbox intersection() fail, so repair just those polygons
+        invalid = is_polygon & ~shapely.is_valid(geometries)
+        if invalid.any():
+            geometries[invalid] = shapely.make_valid(geometries[invalid])
+
+        return geometries
+
+    @staticmethod
+    def _split_coordinates(geometries: np.ndarray) -> List[np.ndarray]:
+        """Return one (n, 2) coordinate array per geometry."""
+        coords, index = shapely.get_coordinates(geometries, return_index=True)
+        if len(coords) == 0:
+            return []
+        return np.split(coords, np.flatnonzero(np.diff(index)) + 1)
+
+    def build_collections(self, geometries: np.ndarray, properties: List[dict], feature_type: str) -> List[Collection]:
+        """Turn prepared geometries of one feature type into styled matplotlib collections."""
+        # Dense area layers are rasterized in vector output; roads stay vector for crispness
+        rasterized = feature_type in self.RASTERIZED_FEATURES
+
+        if feature_type != "roads":
+            style = self.styles.get(feature_type, {"color": "black"})
+            return self._make_collections(geometries, style, style.get("label"), rasterized)
+
+        groups = np.array([self.ROAD_STYLE_GROUPS.get(p.get("highway"), "default") for p in properties], dtype=object)
+        collections = []
+        for group in dict.fromkeys(groups):
+            style = self.styles["roads"][group]
+            collections += self._make_collections(geometries[groups == group], style, style["label"], rasterized)
+        return collections
+
+    def _make_collections(self, geometries: np.ndarray, style: dict, label: Optional[str],
+                          rasterized: bool) -> List[Collection]:
+        """Build at most one LineCollection and one PolyCollection for geometries sharing a style."""
+        parts = shapely.get_parts(geometries)
+        type_ids = shapely.get_type_id(parts)
+        non_empty = ~shapely.is_empty(parts)
+        is_line = np.isin(type_ids, [shapely.GeometryType.LINESTRING, shapely.GeometryType.LINEARRING]) & non_empty
+        is_polygon = (type_ids == shapely.GeometryType.POLYGON) & non_empty
+        color = to_rgba(style["color"], style.get("alpha"))
+
+        collections = []
+        if is_line.any():
+            collections.append(LineCollection(
+                self._split_coordinates(parts[is_line]),
+                colors=color,
+                linewidths=style.get("linewidth", plt.rcParams["lines.linewidth"]),
+                linestyles=style.get("linestyle", "solid"),
+                label=label,
+                rasterized=rasterized,
+            ))
+
+        if is_polygon.any():
+            # OSM ways have no holes, so the exterior ring fully describes each polygon
+            collections.append(PolyCollection(
+                self._split_coordinates(shapely.get_exterior_ring(parts[is_polygon])),
+                facecolors=color,
+                edgecolors=to_rgba(style.get("edgecolor", style["color"]), style.get("alpha")),
+                linewidths=style.get("linewidth", plt.rcParams["patch.linewidth"]),
+                label=label,
+                rasterized=rasterized,
+            ))
+
+        return collections
+
+    def _render_datashader(self, ax, geometries: np.ndarray, feature_type: str) -> List[Collection]:
+        """Rasterize the polygons of a layer with datashader and draw them as one image.
+
+        The image takes the PolyCollection zorder, so it stacks in plot order with the other
+        polygon layers and stays under every line layer, as on the matplotlib backend.
+        Non-polygon parts are returned as collections so the caller can still draw them.
+        """
+        import datashader as ds
+        import datashader.transfer_functions as tf
+
+        style = self.styles.get(feature_type, {"color": "black"})
+        parts = shapely.get_parts(geometries)
+        is_polygon = (shapely.get_type_id(parts) == shapely.GeometryType.POLYGON) & ~shapely.is_empty(parts)
+
+        if is_polygon.any():
+            south, west, north, east = self.bbox
+            fig = ax.get_figure()
+            width = int(fig.get_figwidth() * self.OUTPUT_DPI)
+            height = int(width * (north - south) / (east - west))
+
+            canvas = ds.Canvas(plot_width=width, plot_height=height, x_range=(west, east), y_range=(south, north))
+            polygons = gpd.GeoDataFrame(geometry=parts[is_polygon], crs="EPSG:4326")
+            agg = canvas.polygons(polygons, geometry="geometry", agg=ds.any())
+            alpha = int(255 * style.get("alpha", 1.0))
+            image = tf.shade(agg, cmap=[style["color"]], alpha=alpha, min_alpha=alpha)
+            ax.imshow(
+                image.to_pil(), extent=(west, east, south, north),
+                zorder=PolyCollection.zorder, label=style.get("label"),
+            )
+
+        return self._make_collections(parts[~is_polygon], style, style.get("label"), rasterized=True)
+
+    def _build_layers(self, feature_types: List[str]) -> Dict[str, Tuple[np.ndarray, List[dict]]]:
+        """Return prepared geometries and tags per feature, from GeoParquet if every layer is persisted."""
+        if self.persist_layers:
+            gdfs = {ft: self._load_layer(ft) for ft in feature_types}
+            if all(gdf is not None for gdf in gdfs.values()):
+                logger.info("📦 Loaded all layers from GeoParquet.")
+                if self.keep_geodataframes:
+                    self.gdfs.update(gdfs)
+                return {
+                    ft: (np.asarray(gdf.geometry), gdf.drop(columns=gdf.geometry.name).to_dict("records"))
+                    for ft, gdf in gdfs.items()
+                }
+
+        if self.batch_queries:
+            split_data = self.split_osm_data(self.fetch_osm_data("all"), feature_types)
+        else:
+            # Overpass only grants a few slots per client, so keep concurrency low
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                split_data = dict(zip(feature_types, executor.map(self.fetch_osm_data, feature_types)))
+
+        layers = {}
+        for feature in feature_types:
+            geometries, properties = self._prepare_geometries(split_data[feature], feature)
+            if self.keep_geodataframes or (self.persist_layers and split_data[feature] is not None):
+                gdf = gpd.GeoDataFrame(properties, geometry=geometries, crs="EPSG:4326")
+                if self.keep_geodataframes:
+                    self.gdfs[feature] = gdf
+                # Failed fetches are not persisted, so the next run retries them
+                if self.persist_layers and split_data[feature] is not None:
+                    self._save_layer(gdf, feature)
+            layers[feature] = (geometries, properties)
+
+        return layers
 
     
     def generate_map(self):
         """Generate and save the map."""
         feature_types = ["roads", "buildings", "forests", "rivers", "lakes", "channels", "water"]
-        gdfs = {ft: self.process_osm_data(self.fetch_osm_data(ft), ft) for ft in feature_types}
+        layers = self._build_layers(feature_types)
 
         # Log the number of elements for each feature
-        for feature, gdf in gdfs.items():
-            logger.info(f"📌 {feature.capitalize()} - {len(gdf)} elements.")
+        for feature, (geometries, _) in layers.items():
+            logger.info(f"📌 {feature.capitalize()} - {len(geometries)} elements.")
 
         fig, ax = plt.subplots(figsize=(12, 12))
         ax.set_aspect("equal")
 
         # Plot features in correct order
         plot_order = ["water", "lakes", "forests", "rivers", "channels", "roads", "buildings"]
+        # First artist added per label, so the legend needs no scan over the axes children
+        legend_map: Dict[str, Artist] = {}
 
         for feature in plot_order:
-            if feature in gdfs:
-                gdf = gdfs[feature]
-                if gdf is not None and not gdf.empty:
-                    logger.info(f"🟢 Plotting {feature} ({len(gdf)} elements)")
+            if feature in layers:
+                geometries, properties = layers[feature]
+                if len(geometries) > 0:
+                    logger.info(f"🟢 Plotting {feature} ({len(geometries)} elements)")
 
                     try:
-                        # Special handling for roads
-                        if feature == "roads":
-                            if "highway" in gdf.columns:
-                                for road_type in gdf["highway"].unique():
-                                    subset = gdf[gdf["highway"] == road_type]
-
-                                    if subset.empty:
-                                        logger.warning(f"⚠️ No roads found for type: {road_type}")
-                                        continue
-
-                                    style = self.styles["roads"].get(road_type, self.styles["roads"]["default"])
-                                    subset.plot(ax=ax, label=f"{road_type} road", **style)
-                            else:
-                                logger.warning("⚠️ No 'highway' column in roads data")
-                                gdf.plot(ax=ax, color="black", linewidth=1.5, label="Roads")
+                        if self.render_backend == "datashader" and feature in self.RASTERIZED_FEATURES:
+                            collections = self._render_datashader(ax, geometries, feature)
+                            # Images have no legend handler, so stand in a patch with the layer style
+                            style = self.styles[feature]
+                            legend_map.setdefault(style["label"], Patch(color=style["color"], alpha=style.get("alpha")))
                         else:
-                            # Default for all other layers
-                            gdf.plot(ax=ax, **self.styles.get(feature, {"color": "black"}))
-
+                            collections = self.build_collections(geometries, properties, feature)
+                        for collection in collections:
+                            ax.add_collection(collection)
+                            if collection.get_label():
+                                legend_map.setdefault(collection.get_label(), collection)
                     except Exception as e:
                         logger.error(f"❌ Error plotting {feature}: {str(e)}")
 
+        # Collections do not trigger autoscaling on their own
+        ax.autoscale_view()
+
+        if legend_map:
+            ax.legend(legend_map.values(), legend_map.keys(), loc="upper right")
+
         ax.set_title("OSM Map with Roads, Water, and Buildings")
         ax.set_xlabel("Longitude")
         ax.set_ylabel("Latitude")
 
-        plt.savefig(self.output_dir / "osm_map.jpg", dpi=300, bbox_inches="tight")
+        plt.savefig(self.output_dir / "osm_map.jpg", dpi=self.OUTPUT_DPI, bbox_inches="tight")
+        plt.savefig(self.output_dir / "osm_map.pdf", dpi=self.OUTPUT_DPI, bbox_inches="tight")
         plt.show()
 
 